@@ -2,24 +2,26 @@
 Python add-on for data preprocessing and farmer movement process in the metapopulation model.
 """
 
-import csv
-import dateutil.parser             as     dup
 import numpy                       as     np
 import random
 
+from   functools                   import lru_cache
+from   numba                       import njit
+
 from   emulsion.agent.managers     import MetapopProcessManager
 from   emulsion.tools.preprocessor import EmulsionPreprocessor
 from   emulsion.tools.debug        import debuginfo
 from   emulsion.model.exceptions   import SemanticException
-from   emulsion.tools.functions    import random_normal, random_gamma
-from   betapert                    import pert, mpert
+from   betapert                    import pert
+from   movement_data               import read_moves_csv
+from   movement_helpers            import select_age_groups
 
 #===============================================================
 # Preprocessor class for restructuring farmer movement data
 #===============================================================
 class FarmerMovementsReader(EmulsionPreprocessor):
     """A preprocessor class for reading the CSV that describes farmer movements
-    and restructuring it into a dictionary, stored in shared simulation data.
+    and restructuring it into a list indexed by step, stored in shared simulation data.
     """
 
     def init_preprocessor(self):
@@ -32,7 +34,7 @@ class FarmerMovementsReader(EmulsionPreprocessor):
         """Load farmer movements data from the CSV file into the simulation's shared data.
         
         Expected file format: CSV with the following fields:
-        - date: the date of the movement (in ISO format)
+        - date: the date of the movement (day first, e.g. 31/12/2025 14:44)
         - source: ID of the source farm
         - dest: ID of the destination farm
         - age: age group of the animals being moved
@@ -45,43 +47,100 @@ class FarmerMovementsReader(EmulsionPreprocessor):
             debuginfo('Farmer movements already loaded in the simulation')
 
     def restructure_moves(self):
-        """Restructure the farmer movement CSV data into nested dictionaries.
+        """Restructure the farmer movement CSV data into arrays grouped by simulation step.
 
-        The file contains columns: date, source farm, destination farm, age group, quantity.
+        The file contains columns: date, source farm, destination farm, duration.
 
-        This method restructures the data into a dictionary format based on simulation steps:
-        {
-            step: {
-                source_id: [(dest_id, duration), ...],
-                ...
+        This method restructures the data into a list indexed by simulation step,
+        where the movements of each step are stored as parallel NumPy arrays:
+        [
+            {
+                'src': array of source_id,
+                'dest': array of dest_id,
+                'dur': array of duration,
+                'counted': array telling if the movement can transmit the disease,
+                'risky': array telling if the movement is avoided by biosecurity measures,
             },
             ...
-        }
+        ]
+        Steps without movements are None.
 
         - Steps are calculated based on the simulation origin_date and step_duration.
+        - The checks that only depend on the source and destination of the movements
+          are done here once, instead of at every simulation step.
         """
-        origin = self.model.origin_date
-        step_duration = self.model.step_duration
-        moves = {}
-        with open(self.input_files.trade_file) as csvfile:
-            # Read the CSV file for farmer movements
-            csvreader = csv.DictReader(csvfile, delimiter=',')
-            for row in csvreader:
-                week = dup.parse(row['date'])
-                if week < origin:
-                    # Ignore movements that occurred before the simulation's start date
-                    continue
-                # Convert the movement date into a simulation step
-                step = (week - origin) // step_duration
-                # Group movements by step and source farm
-                if step not in moves:
-                    moves[step] = {}
-                src, dest, dur = int(row['source']), int(row['dest']), float(row['duration'])
-                if src not in moves[step]:
-                    moves[step][src] = []
-                # Append destination farm and movement duration to the list of movements for this step and source
-                moves[step][src].append([dest, dur])
-        return moves
+        moves = read_moves_csv(self.input_files.trade_file, self.model.origin_date, self.model.step_duration)
+        src, dest = moves['src'], moves['dest']
+        # Only movements between different groups count; dressing rooms excluded
+        moves['counted'] = (src != dest) & (dest != 16) & (dest != 17)
+        # Risky movements: fattening -> gestation, nursery or farrowing
+        moves['risky'] = (4 <= src) & (src <= 15) & (1 <= dest) & (dest <= 3)
+        # Other risky movements defined by UGent and ADA
+        moves['risky'] |= ((src == 1) & (dest == 2)) | ((src == 3) & (1 <= dest) & (dest <= 2))
+
+        # Group the movements by step, keeping the order of the file within each step
+        order = np.argsort(moves['step'], kind='stable')
+        steps, starts = np.unique(moves['step'][order], return_index=True)
+        moves_by_step = [None] * (int(steps[-1]) + 1 if len(steps) else 0)
+        for step, part in zip(steps.tolist(), np.split(order, starts[1:])):
+            moves_by_step[step] = {key: moves[key][part] for key in ('src', 'dest', 'dur', 'counted', 'risky')}
+        return moves_by_step
+
+#===============================================================
+# Helper functions
+#===============================================================
+@lru_cache(maxsize=None)
+def _pert_distribution(pessimistic, most_likely, optimistic):
+    """Return the PERT distribution of the probability of biosecurity success.
+    The parameters are model constants, so the distribution is only built
+    once per run and shared by all calls to `external_pathway`."""
+    return pert(pessimistic, most_likely, optimistic)
+
+@njit(cache=True)
+def _accumulate_move_trans(src, dest, dur, counted, risky, total_I, total_herd, between_herd_trans, biosec_remove_risky):
+    """Return the transmission rate to each group from the farmer movements of a step.
+
+    A movement counts if it can transmit the disease (see `counted`) and its
+    source group has pigs; with the biosecurity measure, risky movements are avoided.
+    All movements from fattening become movements from all fattening pens, and
+    all movements to fattening become movements to all fattening pens."""
+    trans_to_dest = np.zeros(total_herd.shape[0])
+    # Portion of infectious pigs in the fattening pens altogether
+    fat_I = 0.0
+    fat_herd = 0.0
+    for i in range(4, 16):
+        fat_I += total_I[i]
+        fat_herd += total_herd[i]
+    fat_portion_I = fat_I / (fat_herd if fat_herd > 0 else 1.0)
+    for m in range(src.shape[0]):
+        s = src[m]
+        if not counted[m] or total_herd[s] == 0 or (biosec_remove_risky and risky[m]):
+            continue
+        # Portion of infectious pigs in the source group
+        portion_I = fat_portion_I if s == 4 else total_I[s] / total_herd[s]
+        # Duration normalized between 0 and 1; divided by total number of minutes in a week
+        trans_to_dest[dest[m]] += dur[m] / 10080 * between_herd_trans * portion_I
+    for i in range(5, 16):
+        trans_to_dest[i] += trans_to_dest[4]
+    return trans_to_dest
+
+@njit(cache=True)
+def _neighbor_trans(total_I, total_herd, neighboring_herd_trans):
+    """Return the transmission rate to each fattening pen from its neighboring pens,
+    i.e. the pens two positions before and after it."""
+    n = total_I.shape[0]
+    trans_between_pens = np.zeros(n)
+    for i in range(n):
+        neighbors_I = 0.0
+        neighbors_herd = 0.0
+        if i >= 2:
+            neighbors_I += total_I[i - 2]
+            neighbors_herd += total_herd[i - 2]
+        if i + 2 < n:
+            neighbors_I += total_I[i + 2]
+            neighbors_herd += total_herd[i + 2]
+        trans_between_pens[i] = neighboring_herd_trans * neighbors_I / (neighbors_herd if neighbors_herd > 0 else 1.0)
+    return trans_between_pens
 
 #===============================================================
 # CLASS Metapopulation (LEVEL 'metapop')
@@ -108,38 +167,58 @@ class Metapopulation(MetapopProcessManager):
         - herd 17: dressing room 2 (no pigs)
         """
         
-        # Get farmer movements and herd populations
+        # Get farmer movements, herd populations and model parameters
         moves = self.simulation.shared_data['moves']
         herds = self.get_populations()
+        params = self.model.parameters
         
         ## TRANSFER PIGS TO THEIR ASSIGNED GROUP
-        
-        # Record gestating sows/gilts from non-gestating group
-        gestating_sows = herds.select_atoms('age_group', 'G')
-        # Remove gestating sows/gilts from non-gestating group
-        herds.remove_atoms(gestating_sows)
-        # Add gestating sows/gilts to gestating group
-        herds.add_atoms(gestating_sows)
-        
-        # Record farrowing sows from gestating group
-        farrowing_sows = herds.select_atoms('age_group', 'F')
+
+        # Record the pigs that changed age group in each group before moving any of them;
+        # pigs entering a group never belong to the age group that leaves it, so the selections are unaffected
+        # Gestating sows/gilts from non-gestating group
+        gestating_sows = herds[0].select_atoms('age_group', 'G')
+        # Farrowing sows from gestating group
+        farrowing_sows = herds[1].select_atoms('age_group', 'F')
+        # Non-gestating sows and nursery pigs from farrowing group, in a single pass over the group
+        farrowing_groups = select_age_groups(herds[2], ('A', 'Jn'))
+        nongestating_sows, nursery = farrowing_groups['A'], farrowing_groups['Jn']
+        # Growers from the nursery
+        growers = herds[3].select_atoms('age_group', 'Jf')
+
         # Record number of farrowing sows to determine number of newborns
-        herds.statevars.nb_new_farrowing_sows = len(farrowing_sows)
-        # Remove farrowing sows from gestating group
-        herds.remove_atoms(farrowing_sows)
+        herds[1].statevars.nb_new_farrowing_sows = len(farrowing_sows)
+
+        # Remove all recorded pigs from their current group
+        herds[0].remove_atoms(gestating_sows)
+        herds[1].remove_atoms(farrowing_sows)
+        herds[2].remove_atoms(nongestating_sows + nursery)
+        herds[3].remove_atoms(growers)
+
+        # Add gestating sows/gilts to gestating group
+        herds[1].add_atoms(gestating_sows)
         # Add farrowing sows to farrowing group
-        herds.add_atoms(farrowing_sows)
-        
+        herds[2].add_atoms(farrowing_sows)
+        # Add non-gestating sows to non-gestating group
+        herds[0].add_atoms(nongestating_sows)
+        # Add nursery pigs to the nursery
+        herds[3].add_atoms(nursery)
+
         # Vertical transmission parameter
-        vert_trans = self.model.parameters.vert_trans
+        vert_trans = params.vert_trans
         ## Produce newborns
         newborn = []
-        qty = self.model.parameters.pba
-        for sow in farrowing_sows:
-            # Number of newborns must be less than capacity
-            if herds.total_Jnb < self.model.parameters.K_herd:
+        qty = params.pba
+        # Number of newborns must be less than capacity (newborns are only added after all sows farrowed)
+        if herds[2].total_Jnb < params.K_herd and len(farrowing_sows) > 0:
+            mean_pba = round(params.mean_pba)
+            sd_pba = round(params.sd_pba)
+            # Draw the number of pigs born alive and the vertical transmission test of all farrowing sows at once
+            pbas = np.random.normal(mean_pba, sd_pba, len(farrowing_sows)).round().clip(0).astype(int)
+            vert_draws = np.random.random(len(farrowing_sows))
+            for sow, pba, vert_draw in zip(farrowing_sows, pbas, vert_draws):
                 # Produced infected newborns
-                if (sow.is_in_state('I') or sow.is_in_state('E')) and vert_trans > random.random():
+                if (sow.is_in_state('I') or sow.is_in_state('E')) and vert_trans > vert_draw:
                     newborn_prototype = 'newborn_E'
                 # Susceptible sows produce susceptible newborns
                 elif sow.is_in_state('S'):
@@ -147,191 +226,141 @@ class Metapopulation(MetapopProcessManager):
                 # Produce newborns with maternal immunity
                 else:
                     newborn_prototype = 'newborn_M'
-                mean_pba = round(self.model.parameters.mean_pba)
-                sd_pba = round(self.model.parameters.sd_pba)
-                pba = round(random.gauss(mean_pba, sd_pba))
-                newborn = newborn + [herds.new_atom(sublevel='animals', prototype=newborn_prototype) for _ in range(pba)]
-                
+                newborn.extend(herds[2].new_atom(sublevel='animals', prototype=newborn_prototype) for _ in range(pba))
+
         if len(newborn) != 0:
-            herds.add_atoms(newborn)
-        
-        ## Transfer corresponding age group of pigs to the correct herd
-# Transfer non-gestating sows to the correct herd
-nongestating_sows = herds.select_atoms('age_group', 'A')
-herds.remove_atoms(nongestating_sows)
-herds.add_atoms(nongestating_sows)
-
-# Transfer nursery pigs to the correct herd
-nursery = herds.select_atoms('age_group', 'Jn')
-herds.remove_atoms(nursery)
-herds.add_atoms(nursery)
-
-# Transfer growers to the correct herd
-growers = herds.select_atoms('age_group', 'Jf')
-herds.remove_atoms(growers)
-
-## Random testing for infectious or exposed animals and then remove them from the population
-# Remove infectious growers based on probability
-growers = [pig for pig in growers if not (pig.is_in_state('I') and np.random.rand() < self.model.parameters.proba_removal_if_I)]
-# Remove exposed growers based on probability
-growers = [pig for pig in growers if not (pig.is_in_state('E') and np.random.rand() < self.model.parameters.proba_removal_if_E)]
-
-# Calculate the excess number of growers
-excess = len(growers) - 144       
-
-## Only 12 fattening pigs per pen (12 pens), others are sold
-new_gilts = []
-if excess > 0:
-    # Select excess growers randomly
-    excess_growers = random.sample(growers, excess)
-    # Some fatteners are bred to gilts
-    total_sows = herds.total_A + herds.total_G + herds.total_F
-    if total_sows < 3 * self.model.parameters.K_sows:  # Multiplied by 3 to get total population of sows and gilts
-        new_gilts = [pig.clone(prototype='nongestating') for pig in excess_growers if pig.is_in_state('Female')]
-    # Only 144 fatteners allowed
-    growers = [x for x in growers if x not in excess_growers]
-
-# Add new gilts to non-gestating group
-if len(new_gilts) != 0:
-    herds.add_atoms(new_gilts)
-
-if len(growers) > 0:
-    # Specify the number of parts (n)
-    n = np.floor(len(growers) / 12)
-    if n == 0:
-        n = 1
-    elif n > 12:
-        n = 12
-else:
-    n = 1
-
-# Use array_split to split the array into n parts
-pens = np.array_split(growers, n)
-
-# Transfer pigs to the fattening pens
-for i, pen in enumerate(pens):
-    herds[i + 4].add_atoms(pen)
-
-## MOVEMENT OF FARMERS
-
-# Reset transmission rate between groups per iteration
-for i in range(self.model.parameters.nb_herds):
-    herds[i].statevars.trans_btwn_pens_frm_movement = 0
-
-if self.statevars.step in moves:
-    trans_I_from_source = 0
-    for source in moves[self.statevars.step]:
-        for dest, dur in moves[self.statevars.step][source]:
-            if source != dest: 
-                # Get parameters for between pen transmission
-                sd_bp_trans = (self.model.parameters.max_bp_trans - self.model.parameters.min_bp_trans) / 4
-                shape_bp_trans = (self.model.parameters.mean_bp_trans / sd_bp_trans) ** 2
-                scale_bp_trans = (sd_bp_trans ** 2) / self.model.parameters.mean_bp_trans
-                bp_trans = random_gamma(shape_bp_trans, scale_bp_trans)
-                
-                ## Force of infection from movement of farmers from one pen to another
-                if herds[source].total_herd > 0 and dest != 16 and dest != 17:  # Dressing rooms excluded
-                    # Normalize duration between 0 and 1; divided by total number of minutes in a week
-                    dur = dur / 10080
-                    
-                    # BIOSECURITY MEASURE: avoid risky movements: fattening -> gestation, nursery or farrowing
-                    if (4 <= source <= 15) and (1 <= dest <= 3) and self.model.parameters.biosec_remove_risky_move == 1:
-                        dur = 0
-                    # Other risky movements defined by UGent and ADA
-                    elif ((source == 1 and dest == 2) or (source == 3 and 1 <= dest <= 2)) and self.model.parameters.biosec_remove_risky_move == 1:
-                        dur = 0
-                        
-                    # BIOSECURITY MEASURE: avoid movement from infected group
-                    if source != 4:  # For non-fattening groups
-                        trans_I_from_source = dur * self.model.parameters.between_herd_trans * herds[source].total_I / herds[source].total_herd
-                    else:  # All movements from fattening become movement from all fattening pens
-                        total_I = 0
-                        total_herd = 0
-                        for i in range(4, 16):
-                            total_I += herds[i].total_I
-                            total_herd += herds[i].total_herd
-                        total_herd = 1 if total_herd == 0 else total_herd
-                        trans_I_from_source = dur * self.model.parameters.between_herd_trans * total_I / total_herd
-                else:
-                    trans_I_from_source = 0
-                # Accumulate transmission rate between groups per movement to destination
-                herds[dest].statevars.trans_btwn_pens_frm_movement += trans_I_from_source
-                # All movements to fattening become a movement to all fattening pens
-                if dest == 4:
-                    for i in range(5, 16):
-                        herds[dest].statevars.trans_btwn_pens_frm_movement += trans_I_from_source
+            herds[2].add_atoms(newborn)
+
+        ## Random testing for infectious or exposed animals and then remove them from the population
+        # Probability of removal of each grower: infectious and exposed growers are removed
+        # based on their own probability, the others are kept (a pig is never both I and E)
+        proba_removal_if_I = params.proba_removal_if_I
+        proba_removal_if_E = params.proba_removal_if_E
+        proba_removal = np.array([proba_removal_if_I if pig.is_in_state('I') else proba_removal_if_E if pig.is_in_state('E') else 0
+                                  for pig in growers], dtype=float)
+        removed = np.random.rand(len(growers)) < proba_removal
+        growers = [pig for pig, rm in zip(growers, removed) if not rm]
+
+        # Calculate the excess number of growers
+        excess = len(growers) - 144       
+
+        ## Only 12 fattening pigs per pen (12 pens), others are sold
+        new_gilts = []
+        if excess > 0:
+            # Select excess growers randomly
+            excess_growers = random.sample(growers, excess)
+            # Some fatteners are bred to gilts
+            total_sows = herds[0].total_A + herds[1].total_G + herds[2].total_F
+            if total_sows < 3 * params.K_sows:  # Multiplied by 3 to get total population of sows and gilts
+                new_gilts = [pig.clone(prototype='nongestating') for pig in excess_growers if pig.is_in_state('Female')]
+            # Only 144 fatteners allowed; pigs are compared by identity
+            excess_ids = set(map(id, excess_growers))
+            growers = [x for x in growers if id(x) not in excess_ids]
+
+        # Add new gilts to non-gestating group
+        if len(new_gilts) != 0:
+            herds[0].add_atoms(new_gilts)
+
+        # Specify the number of parts (n): about 12 growers per pen, between 1 and 12 pens
+        n = min(max(len(growers) // 12, 1), 12)
+
+        # Split the growers into n near-equal parts by slicing the list (the first parts get one pig more),
+        # and transfer them to the fattening pens
+        size, extra = divmod(len(growers), n)
+        start = 0
+        for i in range(n):
+            end = start + size + (1 if i < extra else 0)
+            herds[i + 4].add_atoms(growers[start:end])
+            start = end
+
+        ## MOVEMENT OF FARMERS
+
+        # Transmission rate between groups per iteration; stays zero if farmers do not move
+        trans_to_dest = np.zeros(len(herds))
+
+        step = int(self.statevars.step)
+        step_moves = moves[step] if step < len(moves) else None
+        if step_moves is not None:
+            total_I = np.array([herds[i].total_I for i in range(len(herds))], dtype=float)
+            total_herd = np.array([herds[i].total_herd for i in range(len(herds))], dtype=float)
+
+            ## Force of infection from movement of farmers from one pen to another
+            # BIOSECURITY MEASURE: avoid risky movements
+            trans_to_dest = _accumulate_move_trans(step_moves['src'], step_moves['dest'], step_moves['dur'],
+                                                   step_moves['counted'], step_moves['risky'], total_I, total_herd,
+                                                   float(params.between_herd_trans), params.biosec_remove_risky_move == 1)
+
+        # Reset and set the transmission rate between groups in a single write per group
+        for i in range(params.nb_herds):
+            herds[i].statevars.trans_btwn_pens_frm_movement = trans_to_dest[i]
         
         # print trans rate between groups
         #for i in range(self.model.parameters.nb_herds):
         #    print(herds[i].statevars.trans_btwn_pens_frm_movement)
     
-    ## DETERMINE INFECTIOUS PENS
-def sample_I_from_fatteners(self):
-    """Sample infectious pens from the fatteners."""
-    herds = self.get_populations()
+    # Determine the infectious pens
+    def sample_I_from_fatteners(self):
+        """Sample infectious pens from the fatteners."""
+        herds = self.get_populations()
+        params = self.model.parameters
     
-    # Initialize the count of sampled infectious fatteners
-    herds.statevars.nb_of_sampled_I_Jf = 0
+        # Initialize the count of sampled infectious fatteners
+        herds[4].statevars.nb_of_sampled_I_Jf = 0
     
-    # Count a fattener herd as infectious if at least one pig is infected
-    herds.statevars.nb_of_sampled_I_Jf += sum(1 for i in range(12) if herds[i + 4].total_I > 0)
+        # Count a fattener herd as infectious if at least one pig is infected
+        herds[4].statevars.nb_of_sampled_I_Jf += sum(1 for i in range(12) if herds[i + 4].total_I > 0)
        
-    # Infect neighboring pens depending on the number of infected animals in the pen
-    # Pen configuration is 4, 6, 8, 10, 12, 14, 16 together in a line (in this order)
-    # 5, 7, 9, 11, 13, 15 together in a line (in this order)
-    trans_between_pens = 0
-    for i in range(4, 16):
-        if i == 4:
-            trans_between_pens += self.model.parameters.neighboring_herd_trans * herds[i + 2].total_I / herds[i + 2].total_herd
-            herds[i].statevars.trans_btwn_pens_frm_movement += trans_between_pens
-        elif i == 5:
-            trans_between_pens += self.model.parameters.neighboring_herd_trans * herds[i + 2].total_I / herds[i + 2].total_herd
-            herds[i].statevars.trans_btwn_pens_frm_movement += trans_between_pens
-        elif i == 14:
-            trans_between_pens += self.model.parameters.neighboring_herd_trans * herds[i - 2].total_I / herds[i - 2].total_herd
-            herds[i].statevars.trans_btwn_pens_frm_movement += trans_between_pens
-        elif i == 15:
-            trans_between_pens += self.model.parameters.neighboring_herd_trans * herds[i - 2].total_I / herds[i - 2].total_herd
-            herds[i].statevars.trans_btwn_pens_frm_movement += trans_between_pens
-        else:
-            trans_between_pens += self.model.parameters.neighboring_herd_trans * (herds[i - 2].total_I + herds[i + 2].total_I) / (herds[i - 2].total_herd + herds[i + 2].total_herd)
-            herds[i].statevars.trans_btwn_pens_frm_movement += trans_between_pens
-
-## DISEASE TRANSMISSION FROM OUTSIDE THE FARM
-def external_pathway(self):
-    """Simulate disease transmission from outside the farm."""
-    # Get herd data
-    herds = self.get_populations()
+        # Infect neighboring pens depending on the number of infected animals in the pen
+        # Pen configuration is 4, 6, 8, 10, 12, 14 together in a line (in this order)
+        # 5, 7, 9, 11, 13, 15 together in a line (in this order)
+        # so the neighbors of a pen are the pens two positions before and after it
+        total_I = np.array([herds[i].total_I for i in range(4, 16)], dtype=float)
+        total_herd = np.array([herds[i].total_herd for i in range(4, 16)], dtype=float)
+        trans_between_pens = _neighbor_trans(total_I, total_herd, float(params.neighboring_herd_trans))
+        for i in range(12):
+            herds[i + 4].statevars.trans_btwn_pens_frm_movement += trans_between_pens[i]
+
+    ## DISEASE TRANSMISSION FROM OUTSIDE THE FARM
+    def external_pathway(self):
+        """Simulate disease transmission from outside the farm."""
+        # Get herd data
+        herds = self.get_populations()
+        params = self.model.parameters
     
-    # Get parameter values needed for the simulation
-    proba_encounter = float(self.model.parameters.proba_encounter)
-    proba_trans = float(self.model.parameters.proba_trans)
-    proba_ext_I = float(self.model.parameters.proba_ext_I)
-    proba_success_biosec_ml = float(self.model.parameters.proba_success_biosec_ml)
-    proba_success_biosec_opt = float(self.model.parameters.proba_success_biosec_opt)
-    proba_success_biosec_pes = float(self.model.parameters.proba_success_biosec_pes)
-
-    for h in range(16):  # Loop through all groups
-        # Select susceptible pigs
-        susceptible = herds[h].select_atoms('health_state', 'S')
-
-        # Check if each susceptible pig gets infected
-        for pig in susceptible:  # Loop through all susceptible pigs
-            # Generate probabilities related to disease transmission from outside
-            p_enc = np.random.uniform(0, proba_encounter)
-            p_trans = np.random.uniform(0, proba_trans)
-            p_ext_I = np.random.uniform(0, proba_ext_I)
+        # Get parameter values needed for the simulation
+        proba_encounter = float(params.proba_encounter)
+        proba_trans = float(params.proba_trans)
+        proba_ext_I = float(params.proba_ext_I)
+        proba_success_biosec_ml = float(params.proba_success_biosec_ml)
+        proba_success_biosec_opt = float(params.proba_success_biosec_opt)
+        proba_success_biosec_pes = float(params.proba_success_biosec_pes)
+
+        # Distribution of the probability of biosecurity success
+        P2_pdf = _pert_distribution(proba_success_biosec_pes, proba_success_biosec_ml, proba_success_biosec_opt)
+
+        for h in range(16):  # Loop through all groups
+            # Skip groups without susceptible pigs using the state count, without scanning the group
+            if herds[h].total_S == 0:
+                continue
+            # Select susceptible pigs
+            susceptible = herds[h].select_atoms('health_state', 'S')
+            n = len(susceptible)
+
+            # Generate probabilities related to disease transmission from outside for all susceptible pigs at once
+            p_enc = np.random.uniform(0, proba_encounter, n)
+            p_trans = np.random.uniform(0, proba_trans, n)
+            p_ext_I = np.random.uniform(0, proba_ext_I, n)
             P1 = p_enc * p_trans * p_ext_I  # Probability of transmission without biosecurity
             # Generate the probability of biosecurity success
-            P2_pdf = pert(proba_success_biosec_pes, proba_success_biosec_ml, proba_success_biosec_opt)
-            P2 = P2_pdf.rvs(size=1)
-            # Compute the probability of transmission from an outside source for current susceptible pig
+            P2 = P2_pdf.rvs(size=n)
+            # Compute the probability of transmission from an outside source for each susceptible pig
             R_contact = P1 * (1 - P2)
 
-            if np.random.random() < R_contact:  # Infect susceptible pig if true
+            # Infect only the susceptible pigs for which the draw succeeds
+            for i in np.flatnonzero(np.random.random(n) < R_contact):
                 try:
                     # Change the state of the pig from susceptible to exposed
-                    pig.apply_prototype(name='infected_outside_farm', prototype='infected_outside_farm', execute_actions=True)
+                    susceptible[i].apply_prototype(name='infected_outside_farm', prototype='infected_outside_farm', execute_actions=True)
                 except TypeError as e:
                     print(f"TypeError occurred: {e}")
                     quit()
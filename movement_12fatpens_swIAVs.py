@@ -2,17 +2,16 @@
 Python add-on for data preprocessing and trade movement process in the metapop
 """
 
-import csv
-import dateutil.parser             as     dup
 import numpy                       as     np
-import random
 
+from   itertools                   import islice
+from   numba                       import njit
 from   emulsion.agent.managers     import MetapopProcessManager
 from   emulsion.tools.preprocessor import EmulsionPreprocessor
 from   emulsion.tools.debug        import debuginfo
 from   emulsion.model.exceptions   import SemanticException
-from   emulsion.tools.functions    import random_normal, random_gamma
-from   betapert                    import pert, mpert
+from   movement_data               import read_moves_csv
+from   movement_helpers            import select_age_groups
 
 #===============================================================
 # Preprocessor class for restructuring the file of trade movements
@@ -30,7 +29,7 @@ class TradeMovementsReader(EmulsionPreprocessor):
     def run_preprocessor(self):
         """Expected file format: CSV with following fields
 
-        - date: date of the movement (ISO format)
+        - date: date of the movement (day first, e.g. 31/12/2025 14:44)
         - source: ID of the source herd
         - dest: ID of the dest herd
         - age: age group of the animals to move
@@ -43,37 +42,86 @@ class TradeMovementsReader(EmulsionPreprocessor):
             debuginfo('Trade movements already loaded in simulation')
 
     def restructure_moves(self):
-        """Restructure the CSV file as nested dictionaries"""
+        """Restructure the CSV file as flat arrays sorted by step"""
 
         # read a CSV data file for moves:
-        # date of movement, source herd, destination herd, age group, quantity
-
-        # and restructure it according to origin_date and delta_t:
-        # {step: {source_id: [(dest_id, age_group, dur), ...],
-        #         ...},
-        #  ...}
-        origin = self.model.origin_date
-        step_duration = self.model.step_duration
-        moves = {}
-        with open(self.input_files.trade_file) as csvfile:
-            # read the CSV file
-            csvreader = csv.DictReader(csvfile, delimiter=',')
-            for row in csvreader:
-                week = dup.parse(row['date'])
-                if week < origin:
-                    # ignore dates before origin_date
-                    continue
-                # convert dates into simulation steps
-                step = (week - origin) // step_duration
-                # group information by step and source herd
-                if step not in moves:
-                    moves[step] = {}
-                src, dest, dur = int(row['source']), int(row['dest']), float(row['duration'])
-                if src not in moves[step]:
-                    moves[step][src] = []
-                moves[step][src].append([dest, dur])
+        # date of movement, source herd, destination herd, duration
+
+        # and restructure it according to origin_date and delta_t,
+        # the moves being stored as parallel arrays sorted by step,
+        # with the moves of step k at positions offsets[k] to offsets[k+1]:
+        # {'src': array of source_id,
+        #  'dest': array of dest_id,
+        #  'dur': array of duration,
+        #  'offsets': array of the position of the first move of each step}
+        table = read_moves_csv(self.input_files.trade_file, self.model.origin_date, self.model.step_duration)
+        # only movements between different groups can transmit the disease; dressing rooms excluded
+        # (the other movements are dropped here once, instead of being skipped at every step)
+        counted = np.flatnonzero((table['src'] != table['dest']) & (table['dest'] != 16) & (table['dest'] != 17))
+        table = {key: table[key][counted] for key in ('step', 'src', 'dest', 'dur')}
+        # sort information by step, keeping the order of the file within each step
+        order = np.argsort(table['step'], kind='stable')
+        steps = table['step'][order]
+        nb_steps = int(steps[-1]) + 1 if len(steps) else 0
+        moves = {key: table[key][order] for key in ('src', 'dest', 'dur')}
+        moves['offsets'] = np.searchsorted(steps, np.arange(nb_steps + 1))
         return moves
 
+#===============================================================
+# Helper functions
+#===============================================================
+def _state_mask(atoms, state):
+    """Return a boolean NumPy array telling which of the atoms are in the
+    specified state, so that tests on the atoms can be vectorized."""
+    return np.fromiter((atom.is_in_state(state) for atom in atoms), dtype=bool, count=len(atoms))
+
+@njit(cache=True)
+def _accumulate_move_trans(src, dest, dur, total_I, total_herd, between_herd_trans, biosec_remove_risky):
+    """Return the transmission rate to each group from the farmer movements of a step.
+
+    Only movements from a group with pigs count (the movements that can never transmit
+    the disease are dropped when reading the data); with the biosecurity measure,
+    risky movements are avoided.
+    All movements from fattening become movements from all fattening pens, and
+    all movements to fattening become movements to all fattening pens."""
+    trans_to_dest = np.zeros(total_herd.shape[0])
+    # portion of infectious pigs in each group, computed once per group instead of once per movement
+    portion_I = total_I / np.where(total_herd == 0, 1.0, total_herd)
+    # all movements from fattening becomes movement from all fattening pens
+    fat_herd = total_herd[4:16].sum()
+    portion_I[4] = total_I[4:16].sum() / (fat_herd if fat_herd != 0 else 1.0)
+    for m in range(src.shape[0]):
+        s = src[m]
+        d = dest[m]
+        if total_herd[s] == 0:
+            continue
+        # BIOSECURITY MEASURE: avoid risky movements: fattening -> gestation, nursery or farrowing,
+        # and other risky movements defined by UGent and ADA
+        if biosec_remove_risky and (((4 <= s <= 15) and (1 <= d <= 3)) or (s == 1 and d == 2) or (s == 3 and 1 <= d <= 2)):
+            continue
+        # duration normalize between 0 and 1; divided by total number of minutes in a week
+        trans_to_dest[d] += dur[m] / 10080 * between_herd_trans * portion_I[s]
+    for i in range(5, 16):
+        trans_to_dest[i] += trans_to_dest[4]
+    return trans_to_dest
+
+@njit(cache=True)
+def _pen_trans(total_I, total_herd, neighboring_herd_trans):
+    """Return the transmission rate to each fattening pen from all other pens,
+    based on the portion of infected pigs in the other pens.
+    The loop is kept serial (no `parallel=True`/`prange`): with 12 pens, starting
+    threads costs more than the loop itself, and simulations are already run in
+    parallel processes during parameter estimation."""
+    all_I = total_I.sum()
+    all_herd = total_herd.sum()
+    trans_between_pens = np.empty(total_I.shape[0])
+    for i in range(total_I.shape[0]):
+        # no infected pigs in the other pens if they are empty
+        others_herd = all_herd - total_herd[i]
+        portion_I = (all_I - total_I[i]) / (others_herd if others_herd != 0 else 1.0)
+        trans_between_pens[i] = neighboring_herd_trans * portion_I
+    return trans_between_pens
+
 #===============================================================
 # CLASS Metapopulation (LEVEL 'metapop')
 #===============================================================
@@ -83,6 +131,45 @@ class Metapopulation(MetapopProcessManager):
 
     """
 
+    #----------------------------------------------------------------
+    # Populations
+    #----------------------------------------------------------------
+    def _herds(self):
+        """Return the populations of the metapopulation, shared by all processes
+        of a step: `get_populations` builds a new dictionary at each call, while
+        the set of populations does not change during a step."""
+        step = self.statevars.step
+        if getattr(self, '_herds_cache', (None, None))[0] != step:
+            self._herds_cache = (step, self.get_populations())
+        return self._herds_cache[1]
+
+    def _totals(self):
+        """Return the number of infected pigs and the number of pigs of all groups
+        as two NumPy arrays, recorded once per step and shared by all processes
+        of the step instead of reading the counts of each group in each process."""
+        if getattr(self, '_totals_step', None) != self.statevars.step:
+            self._update_totals()
+        return self._tot_I, self._tot_herd
+
+    def _update_totals(self):
+        """Record the number of infected pigs and the number of pigs of all groups.
+        Must be called again whenever pigs are moved between groups during a step."""
+        herds = self._herds()
+        self._tot_I = np.array([herds[i].total_I for i in range(len(herds))], dtype=float)
+        self._tot_herd = np.array([herds[i].total_herd for i in range(len(herds))], dtype=float)
+        self._totals_step = self.statevars.step
+
+    #----------------------------------------------------------------
+    # Random numbers
+    #----------------------------------------------------------------
+    def _random_generator(self):
+        """Return the NumPy random generator of the metapopulation, created on first use.
+        It is seeded from NumPy's global random state, so that its draws
+        follow the seed given to EMULSION."""
+        if getattr(self, '_rng', None) is None:
+            self._rng = np.random.default_rng(np.random.randint(2**31 - 1))
+        return self._rng
+
     #----------------------------------------------------------------
     # Processes
     #----------------------------------------------------------------
@@ -97,70 +184,68 @@ class Metapopulation(MetapopProcessManager):
         herd 17 is for dressing room 2 (no pigs)
         """
         moves = self.simulation.shared_data['moves']
-        herds = self.get_populations()
+        herds = self._herds()
+        params = self.model.parameters
+        rng = self._random_generator()
         
         ## TRANSFER PIGS TO THEIR ASSIGNED GROUP
         
+        # record the pigs leaving each group before moving any of them, so that each group
+        # is updated by a single remove_atoms and a single add_atoms call
         # record gestating sows/gilt from nongestating group
         gestating_sows = herds[0].select_atoms('age_group', 'G')
-        # remove gestating sows/gilt from nongestating group
-        herds[0].remove_atoms(gestating_sows)
-        # add gestating sows/gilt to gestating group
-        herds[1].add_atoms(gestating_sows)
-        
         # record farrowing sows from gestating group
         farrowing_sows = herds[1].select_atoms('age_group', 'F')
+        # record nongestating sows and nursery pigs from farrowing group in a single pass over the group
+        farrowing_groups = select_age_groups(herds[2], ('A', 'Jn'))
+        nongestating_sows, nursery = farrowing_groups['A'], farrowing_groups['Jn']
+        # record growers from the nursery
+        growers = herds[3].select_atoms('age_group', 'Jf')
+
         # record number of farrowing sows to determine number of newborns
         herds[1].statevars.nb_new_farrowing_sows = len(farrowing_sows)
-        # remove farrowing sows from gestating group
+
+        # remove all recorded pigs from their current group
+        herds[0].remove_atoms(gestating_sows)
         herds[1].remove_atoms(farrowing_sows)
-        # add farrowing sows to farrowing group
-        herds[2].add_atoms(farrowing_sows)
+        herds[2].remove_atoms(nongestating_sows + nursery)
+        herds[3].remove_atoms(growers)
         
-        vert_trans = self.model.parameters.vert_trans
+        vert_trans = params.vert_trans
         # produce newborns
         newborn = []
-        qty = self.model.parameters.pba
-        for sow in farrowing_sows:
-            # number of newborns must be less than capacity
-            if herds[2].total_Jnb < self.model.parameters.K_herd:
-                # produced infected newborns
-                if (sow.is_in_state('I') or sow.is_in_state('E')) and vert_trans > random.random():
-                    newborn_prototype = 'newborn_E'
-                # susceptible sows produce susceptible newborns
-                elif sow.is_in_state('S'):
-                    newborn_prototype = 'newborn_S'
-                # produce newborns with maternal immunity
-                else:
-                    newborn_prototype = 'newborn_M'
-                mean_pba = round(self.model.parameters.mean_pba)
-                sd_pba = round(self.model.parameters.sd_pba)
-                pba = round(random.gauss(mean_pba, sd_pba))
-                newborn = newborn + [herds[2].new_atom(sublevel='animals', prototype=newborn_prototype) for _ in range(pba)]
+        qty = params.pba
+        # number of newborns must be less than capacity (newborns are only added after all sows farrowed)
+        if herds[2].total_Jnb < params.K_herd and len(farrowing_sows) > 0:
+            mean_pba = round(params.mean_pba)
+            sd_pba = round(params.sd_pba)
+            # draw the number of pigs born alive and the vertical transmission test of all farrowing sows at once
+            pbas = rng.normal(mean_pba, sd_pba, len(farrowing_sows)).round().clip(0).astype(int)
+            vert_draws = rng.random(len(farrowing_sows))
+            # produced infected newborns
+            infected = (_state_mask(farrowing_sows, 'I') | _state_mask(farrowing_sows, 'E')) & (vert_trans > vert_draws)
+            # susceptible sows produce susceptible newborns
+            susceptible = ~infected & _state_mask(farrowing_sows, 'S')
+            # produce newborns with maternal immunity
+            newborn_prototypes = np.where(infected, 'newborn_E', np.where(susceptible, 'newborn_S', 'newborn_M'))
+            newborn = [herds[2].new_atom(sublevel='animals', prototype=newborn_prototype)
+                       for newborn_prototype in np.repeat(newborn_prototypes, pbas).tolist()]
                 
         #newborn = [herds[2].new_atom(sublevel='animals', prototype='newborn_M') 
         #           if vert_trans < np.random.rand()
         #           else herds[2].new_atom(sublevel='animals', prototype='newborn_E')
         #           for _ in range(qty)]
-        if len(newborn) != 0:
-            herds[2].add_atoms(newborn)
         #herds[1].add_atoms(piglets)
-        
-        # transfer corresponding age group of pigs to the correct herd
-        nongestating_sows = herds[2].select_atoms('age_group', 'A')
-        herds[2].remove_atoms(nongestating_sows)
-        herds[0].add_atoms(nongestating_sows)
-        
-        nursery = herds[2].select_atoms('age_group', 'Jn')
-        herds[2].remove_atoms(nursery)
-        herds[3].add_atoms(nursery)
-        
-        growers = herds[3].select_atoms('age_group', 'Jf')
-        herds[3].remove_atoms(growers) 
 
         # random testing for infectious or exposed animals and then removed from the population
-        growers = [pig for pig in growers if not (pig.is_in_state('I') and np.random.rand() < self.model.parameters.proba_removal_if_I)]
-        growers = [pig for pig in growers if not (pig.is_in_state('E') and np.random.rand() < self.model.parameters.proba_removal_if_E)]
+        # probability of removal of each grower in a single pass: infectious and exposed growers are removed
+        # based on their own probability, the others are kept (a pig is never both I and E)
+        proba_removal_if_I = params.proba_removal_if_I
+        proba_removal_if_E = params.proba_removal_if_E
+        proba_removal = np.array([proba_removal_if_I if pig.is_in_state('I') else proba_removal_if_E if pig.is_in_state('E') else 0
+                                  for pig in growers], dtype=float)
+        removed = rng.random(len(growers)) < proba_removal
+        growers = [growers[i] for i in np.flatnonzero(~removed)]
 
         # counts and print the number of infected + exposed pigs
         #count_I_E = sum(pig.is_in_state('I') or pig.is_in_state('E') for pig in growers)
@@ -171,101 +256,62 @@ class Metapopulation(MetapopProcessManager):
         # only 12 fattening pigs per pen (12 pens), other are sold
         new_gilts = []
         if excess > 0:
-            excess_growers = random.sample(growers, excess)
-            # some fatteners are bred to gilts
-            total_sows = herds[0].total_A + herds[1].total_G + herds[2].total_F
-            if total_sows < 3 * self.model.parameters.K_sows: # multiplied by 3 to get total population of sows and gilts
-                new_gilts = [pig.clone(prototype='nongestating') 
-                             for pig in excess_growers if pig.is_in_state('Female')]
-            # only 144 fatteners allowed
-            growers = [x for x in growers if x not in excess_growers]
-        
-        # add new gilts to nongestating group
-        if len(new_gilts) != 0:
-            herds[0].add_atoms(new_gilts)
+            excess_idx = rng.choice(len(growers), size=excess, replace=False)
+            # some fatteners are bred to gilts; sows not added to their new group yet are counted separately
+            total_sows = (herds[0].total_A + herds[1].total_G + herds[2].total_F
+                          + len(nongestating_sows) + len(gestating_sows) + len(farrowing_sows))
+            # only the missing sows and gilts are bred, so that no more pigs than needed are cloned
+            nb_new_gilts = int(3 * params.K_sows - total_sows) # multiplied by 3 to get total population of sows and gilts
+            if nb_new_gilts > 0:
+                # excess growers are in random order, so the first females are a random sample of them
+                female_excess_growers = (pig for pig in (growers[i] for i in excess_idx) if pig.is_in_state('Female'))
+                new_gilts = [pig.clone(prototype='nongestating') for pig in islice(female_excess_growers, nb_new_gilts)]
+            # only 144 fatteners allowed; mask the excess growers by index instead of searching them in a list
+            keep = np.ones(len(growers), dtype=bool)
+            keep[excess_idx] = False
+            growers = [growers[i] for i in np.flatnonzero(keep)]
         
-        if len(growers) > 0:
-            # Specify the number of parts (n)
-            n = np.floor(len(growers) / 12)
-            if n == 0:
-                n = 1
-            elif n > 12:
-                n = 12
-        else: n = 1
+        # add nongestating sows and new gilts to nongestating group
+        herds[0].add_atoms(nongestating_sows + new_gilts)
+        # add gestating sows/gilt to gestating group
+        herds[1].add_atoms(gestating_sows)
+        # add farrowing sows and newborns to farrowing group
+        herds[2].add_atoms(farrowing_sows + newborn)
+        # add nursery pigs to the nursery
+        herds[3].add_atoms(nursery)
         
-        # Use array_split to split the array into n parts
-        pens = np.array_split(growers, n)
+        # Specify the number of parts (n): about 12 growers per pen, between 1 and 12 pens
+        n = min(max(len(growers) // 12, 1), 12)
         
-        #transfer pigs to the fattening pens
-        for i, pen in enumerate(pens):
-            herds[i + 4].add_atoms(pen)
+        # split the growers into n near-equal parts by slicing the list (the first parts get one pig more),
+        # and transfer them to the fattening pens
+        size, extra = divmod(len(growers), n)
+        start = 0
+        for i in range(n):
+            end = start + size + (1 if i < extra else 0)
+            herds[i + 4].add_atoms(growers[start:end])
+            start = end
+        # record the counts of the groups after moving the pigs
+        self._update_totals()
         
         ## MOVEMENT OF FARMERS
 
-        # trans rate between groups goes back to zero per iteration
-        for i in range(self.model.parameters.nb_herds):
-            herds[i].statevars.trans_btwn_pens_frm_movement = 0
-            
-        if self.statevars.step in moves:
-            trans_I_from_source = 0
-            for source in moves[self.statevars.step]:
-                for dest, dur in moves[self.statevars.step][source]:
-                    if source != dest: 
-                        #parameters for between pen transmission
-                        # print(source, dest)
-                        sd_bp_trans = (self.model.parameters.max_bp_trans - self.model.parameters.min_bp_trans) / 4
-                        shape_bp_trans = (self.model.parameters.mean_bp_trans / sd_bp_trans) ** 2
-                        scale_bp_trans = (sd_bp_trans ** 2) / self.model.parameters.mean_bp_trans
-                        bp_trans = random_gamma(shape_bp_trans, scale_bp_trans)
-                        
-                        # force of infection from movement of farmers from one pen to another
-                        if herds[source].total_herd > 0 and dest != 16 and dest != 17: # dressing rooms excluded
-                            # check if movement must be made if source is infected
-                            # rand = 1
-                            #if herds[source].total_I > 0:
-                            #    rand = 0
-                            #trans_I_from_source = herds[source].total_I * bp_trans / self.model.parameters.HEV_length
-                            # duration normalize between 0 and 1; divided by total number of minutes in a week
-                            dur = dur / 10080
-                            
-                            # BIOSECURITY MEASURE: avoid risky movements: fattening -> gestation, nursery or farrowing
-                            if (4 <= source <= 15) and (1 <= dest <= 3) and self.model.parameters.biosec_remove_risky_move == 1:
-                                dur = 0 #if np.random.random() <= 0.5 else dur
-                            # other risky movements defined by UGent and ADA
-                            elif ((source == 1 and dest == 2) or (source == 3 and 1 <= dest <= 2)) and self.model.parameters.biosec_remove_risky_move == 1:
-                                dur = 0 #if np.random.random() <= 0.5 else dur
-                            # risky movement from nursery area only
-                            #if (source == 3 and 1 <= dest <= 2) and self.model.parameters.biosec_remove_risky_move == 1:
-                            #    dur = 0
-                            # risky movement from gestation to farrowing only
-                            #if (source == 1 and dest == 2) and self.model.parameters.biosec_remove_risky_move == 1:
-                            #    dur = 0
-                            # clean movements going to fattening only
-                            #if (4 <= source <= 15) and self.model.parameters.biosec_remove_risky_move == 1:
-                            #    dur = 0
-                                
-                            # BIOSECURITY MEASURE: avoid movement from infected group
-                            #if herds[source].total_I > 0 and self.model.parameters.biosec_remove_risky_move == 1:
-                            #    dur = 0 
-                            
-                            if source != 4:  
-                                trans_I_from_source = dur * self.model.parameters.between_herd_trans * herds[source].total_I / herds[source].total_herd
-                            else: # all movements from fattening becomes movement from all fattening pens
-                                total_I = 0
-                                total_herd = 0
-                                for i in range (4,16):
-                                    total_I += herds[i].total_I
-                                    total_herd += herds[i].total_herd
-                                total_herd = 1 if total_herd == 0 else total_herd
-                                trans_I_from_source = dur * self.model.parameters.between_herd_trans * total_I / total_herd
-                        else:
-                            trans_I_from_source = 0
-                        # transmission rate between groups accumulates per movement to destination
-                        herds[dest].statevars.trans_btwn_pens_frm_movement += trans_I_from_source
-                        # all movements to fattening becomes a movement to all fattening pens
-                        if dest == 4:
-                            for i in range (5,16):
-                                herds[dest].statevars.trans_btwn_pens_frm_movement += trans_I_from_source
+        # trans rate between groups goes back to zero per iteration, and stays zero if farmers do not move
+        trans_to_dest = np.zeros(len(herds))
+
+        # position of the moves of the current step in the arrays of moves
+        step = int(self.statevars.step)
+        first, last = moves['offsets'][step:step + 2] if step + 1 < len(moves['offsets']) else (0, 0)
+
+        if last > first:
+            total_I, total_herd = self._totals()
+            # force of infection from movement of farmers from one pen to another
+            trans_to_dest = _accumulate_move_trans(moves['src'][first:last], moves['dest'][first:last], moves['dur'][first:last],
+                                                   total_I, total_herd, float(params.between_herd_trans),
+                                                   params.biosec_remove_risky_move == 1)
+
+        for i in range(params.nb_herds):
+            herds[i].statevars.trans_btwn_pens_frm_movement = trans_to_dest[i]
         
         # print trans rate between groups
         #for i in range(self.model.parameters.nb_herds):
@@ -274,7 +320,8 @@ class Metapopulation(MetapopProcessManager):
     # Determine the infectious pens
     def sample_I_from_fatteners(self):
         
-        herds = self.get_populations()
+        herds = self._herds()
+        params = self.model.parameters
         
         herds[4].statevars.nb_of_sampled_I_Jf = 0
         
@@ -287,82 +334,86 @@ class Metapopulation(MetapopProcessManager):
         #        herds[i + 4].add_atoms(infected_pig)
         
         # Counts a fattener herd if it is infectious; infectious if at least one pig is infected
-        herds[4].statevars.nb_of_sampled_I_Jf += sum(1 for i in range(12) if herds[i + 4].total_I > 0)
+        total_I, total_herd = self._totals()
+        herds[4].statevars.nb_of_sampled_I_Jf += int(np.count_nonzero(total_I[4:16] > 0))
            
         # infect neigboring pens depending on the number of infected animals in the pen 
         # any pair of pens can infect each other since swine flu can be transmitted via aerosol
-        trans_between_pens = 0
-        for i in range(4, 16):
-            total_I = 0
-            total_herd = 0
-            portion_I = 0
-            for j in range(4, 16):
-                if j != i:
-                    total_I += herds[j].total_I
-                    total_herd += herds[j].total_herd
-            if total_herd != 0:
-                portion_I = total_I / total_herd
-            herds[i].statevars.trans_btwn_pens_frm_movement = self.model.parameters.neighboring_herd_trans * portion_I
-            #print(herds[i].statevars.trans_btwn_pens_frm_movement)
+        trans_between_pens = _pen_trans(total_I[4:16], total_herd[4:16], float(params.neighboring_herd_trans))
+        for i in range(12):
+            herds[i + 4].statevars.trans_btwn_pens_frm_movement = trans_between_pens[i]
+            #print(herds[i + 4].statevars.trans_btwn_pens_frm_movement)
     
     # Third pathway of infection among areas in the farm
     def third_trans_pathway(self):
-        herds = self.get_populations()
-	# Each farm can be infected by any other areas in the farm depending on the number of infection in an area
-        for i in range(5):
-            total_I = 0
-            total_herd = 0
-            portion_I = 0
-            for j in range(5):
-                if i != j:
-                    total_I += herds[j].total_I
-                    total_herd = herds[j].total_herd
-                    if total_herd != 0:
-                        portion_I = total_I / total_herd 
-            if i == 4:
-                for i in range(4,16):
-                    herds[i].statevars.trans_frm_3rd_path = self.model.parameters.third_path_trans * portion_I
-            else:
-                herds[i].statevars.trans_frm_3rd_path = self.model.parameters.third_path_trans * portion_I
+        herds = self._herds()
+        params = self.model.parameters
+        # Each area of the farm can be infected by any other areas in the farm depending on the number of infection in an area
+        # areas 0-3 are groups 0-3, area 4 is the fattening area made of all fattening pens (4-15)
+        group_I, group_herd = self._totals()
+        total_I = np.append(group_I[:4], group_I[4:16].sum())
+        total_herd = np.append(group_herd[:4], group_herd[4:16].sum())
+        # portion of infected pigs in all other areas, from the totals over all areas
+        others_I = total_I.sum() - total_I
+        others_herd = total_herd.sum() - total_herd
+        portion_I = others_I / np.where(others_herd == 0, 1, others_herd)
+        trans_frm_3rd_path = params.third_path_trans * portion_I
+        for i in range(4):
+            herds[i].statevars.trans_frm_3rd_path = trans_frm_3rd_path[i]
+        # all fattening pens get the transmission to the fattening area
+        for i in range(4, 16):
+            herds[i].statevars.trans_frm_3rd_path = trans_frm_3rd_path[4]
 
     # external pathway of disease
     def external_pathway(self):
         # transmission from vermin
-        herds = self.get_populations()
-        proba_encounter = float(self.model.parameters.proba_encounter)
-        proba_trans = float(self.model.parameters.proba_trans)
-        proba_ext_I = float(self.model.parameters.proba_ext_I)
-        proba_success_biosec_ml = float(self.model.parameters.proba_success_biosec_ml)
-        proba_success_biosec_opt = float(self.model.parameters.proba_success_biosec_opt)
-        proba_success_biosec_pes = float(self.model.parameters.proba_success_biosec_pes)
+        herds = self._herds()
+        params = self.model.parameters
+        proba_encounter = float(params.proba_encounter)
+        proba_trans = float(params.proba_trans)
+        proba_ext_I = float(params.proba_ext_I)
+        proba_success_biosec_ml = float(params.proba_success_biosec_ml)
+        proba_success_biosec_opt = float(params.proba_success_biosec_opt)
+        proba_success_biosec_pes = float(params.proba_success_biosec_pes)
+
+        rng = self._random_generator()
+
+        # the probability of biosecurity success follows a PERT distribution, i.e. a beta distribution
+        # scaled between the pessimistic and optimistic values, sampled directly with the generator
+        biosec_range = proba_success_biosec_opt - proba_success_biosec_pes
+        biosec_alpha = 1 + 4 * (proba_success_biosec_ml - proba_success_biosec_pes) / biosec_range
+        biosec_beta = 1 + 4 * (proba_success_biosec_opt - proba_success_biosec_ml) / biosec_range
 
         for h in range(16):
             #if h == 4:
             #    h = np.random.randint(4, 16)
 
             susceptible = herds[h].select_atoms('health_state', 'S')
+            n = len(susceptible)
+
+            # draw the probabilities of transmission from outside of all susceptible pigs at once
+            p_enc = rng.uniform(0, proba_encounter, n)
+            p_trans = rng.uniform(0, proba_trans, n)
+            p_ext_I = rng.uniform(0, proba_ext_I, n)
+            P1 = p_enc * p_trans * p_ext_I
+            P2 = proba_success_biosec_pes + biosec_range * rng.beta(biosec_alpha, biosec_beta, n)
+            R_contact = P1 * (1 - P2)
+            #print(R_contact)
+
+            # change the state only of the susceptible pigs for which the draw succeeds
+            for i in np.flatnonzero(rng.random(n) < R_contact):
+                pig = susceptible[i]
+                #current_state = pig.statevars['health_state']
+                #print(f"Changing state for pig: {pig}")
+                #print(f"Current state: {current_state} (type: {type(current_state)})")
+                #print(f"Changing to state: E")
 
-            for pig in susceptible:
-                p_enc = np.random.uniform(0, proba_encounter)
-                p_trans = np.random.uniform(0, proba_trans)
-                p_ext_I = np.random.uniform(0, proba_ext_I)
-                P1 = p_enc * p_trans * p_ext_I
-                #P2_pdf = pert(proba_success_biosec_pes, proba_success_biosec_ml, proba_success_biosec_opt)
-                P2 = np.random.uniform(proba_success_biosec_pes,proba_success_biosec_opt) #P2_pdf.rvs(size=1)[0]
-                R_contact = P1 * (1 - P2)
-                #print(R_contact)
-                if np.random.random() < R_contact:
-                    #current_state = pig.statevars['health_state']
-                    #print(f"Changing state for pig: {pig}")
-                    #print(f"Current state: {current_state} (type: {type(current_state)})")
-                    #print(f"Changing to state: E")
-                    
-                    try:
-                        pig.apply_prototype(name='infected_outside_farm', prototype='infected_outside_farm', execute_actions=True)
-                        #print(f"New state: {pig.statevars['health_state']} (type: {type(pig.statevars['health_state'])})")
-                    except TypeError as e:
-                        print(f"TypeError occurred: {e}")
-                        quit()
-                    except Exception as e:
-                        print(f"An unexpected error occurred: {e}")
-                        quit()
+                try:
+                    pig.apply_prototype(name='infected_outside_farm', prototype='infected_outside_farm', execute_actions=True)
+                    #print(f"New state: {pig.statevars['health_state']} (type: {type(pig.statevars['health_state'])})")
+                except TypeError as e:
+                    print(f"TypeError occurred: {e}")
+                    quit()
+                except Exception as e:
+                    print(f"An unexpected error occurred: {e}")
+                    quit()
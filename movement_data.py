@@ -0,0 +1,99 @@
+"""
+Python helpers shared by the movement add-ons for reading the farmer movement data.
+"""
+
+import hashlib
+import numpy                       as     np
+import os
+import pandas                      as     pd
+import pickle
+
+from   emulsion.tools.debug        import debuginfo
+
+# Version of the structure of the cached movements; to be increased
+# whenever read_moves_csv changes the structure of its result
+MOVES_CACHE_VERSION = 3
+
+def _file_digest(path):
+    """Return the SHA-256 digest of the content of the file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _is_valid_cache(cached, digest, origin, step_duration):
+    """Tell if the content of a cache file holds the movements of read_moves_csv
+    for the specified CSV digest, origin and step_duration. Sidecar files written
+    with another structure (e.g. by an older version of one of the add-ons) are
+    rejected instead of being returned to a reader expecting this structure."""
+    return (isinstance(cached, dict) and cached.get('version') == MOVES_CACHE_VERSION
+            and cached.get('digest') == digest and cached.get('origin') == origin
+            and cached.get('step_duration') == step_duration
+            and isinstance(cached.get('moves'), dict) and set(cached['moves']) == {'step', 'src', 'dest', 'dur'})
+
+def read_moves_csv(trade_file, origin, step_duration):
+    """Read the CSV file of farmer movements and return the movements that
+    occurred from the origin date onwards as parallel NumPy arrays:
+    {
+        'step': simulation step of each movement,
+        'src': ID of the source herd,
+        'dest': ID of the destination herd,
+        'dur': duration of the movement (minutes),
+    }
+
+    Expected file format: CSV with the following fields:
+    - date: the date of the movement (day first, e.g. 31/12/2025 14:44)
+    - source: ID of the source herd
+    - dest: ID of the destination herd
+    - duration: duration of the movement (minutes)
+
+    - Steps are calculated based on the simulation origin and step_duration.
+    - The arrays are pickled next to the CSV file when possible and reused as long as the
+      content of the CSV file (SHA-256 digest), the origin and step_duration
+      are unchanged. Hashing the file takes a few milliseconds, much less than
+      parsing it, and is not fooled by copies or checkouts changing its mtime.
+    """
+    cache_file = trade_file.with_name(trade_file.name + '.pkl')
+    digest = _file_digest(trade_file)
+    if cache_file.exists():
+        # The cache is best-effort: an unreadable or truncated cache file is ignored and the CSV file reparsed
+        try:
+            with open(cache_file, 'rb') as f:
+                cached = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            debuginfo('Ignoring unreadable cached movements {}: {}'.format(cache_file, e))
+            cached = None
+        if _is_valid_cache(cached, digest, origin, step_duration):
+            debuginfo('Using cached movements from {}'.format(cache_file))
+            return cached['moves']
+
+    data = pd.read_csv(trade_file, usecols=['date', 'source', 'dest', 'duration'],
+                       dtype={'source': np.int32, 'dest': np.int32, 'duration': np.float64})
+    dates = pd.to_datetime(data['date'], dayfirst=True)
+    # Ignore movements that occurred before the simulation's start date
+    after_origin = (dates >= origin).to_numpy()
+    # Convert the movement dates into simulation steps
+    steps = (dates[after_origin] - origin) // step_duration
+    moves = {
+        'step': steps.to_numpy(dtype=np.int64),
+        'src': data['source'].to_numpy()[after_origin],
+        'dest': data['dest'].to_numpy()[after_origin],
+        'dur': data['duration'].to_numpy()[after_origin],
+    }
+
+    # Write to a temporary file first, so that simulations running in parallel never read a partial cache;
+    # the movements are still returned if the cache cannot be written (e.g. read-only data directory, full disk)
+    tmp_file = cache_file.with_name('{}.{}.tmp'.format(cache_file.name, os.getpid()))
+    try:
+        with open(tmp_file, 'wb') as f:
+            pickle.dump({'version': MOVES_CACHE_VERSION, 'digest': digest, 'origin': origin, 'step_duration': step_duration, 'moves': moves},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except (OSError, pickle.PicklingError) as e:
+        debuginfo('Could not cache the movements in {}: {}'.format(cache_file, e))
+        try:
+            tmp_file.unlink()
+        except OSError:
+            pass
+    return moves
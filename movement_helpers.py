@@ -0,0 +1,14 @@
+"""
+Python helpers shared by the movement add-ons for handling the pigs of the groups.
+"""
+
+def select_age_groups(herd, age_groups):
+    """Return a dictionary mapping each of the specified age groups to the
+    list of atoms of the herd in that age group, using a single pass over the
+    atoms of the herd (instead of one `select_atoms` call per age group)."""
+    selected = {herd.model.get_value(age_group): [] for age_group in age_groups}
+    for atom in herd.select_atoms():
+        group = selected.get(atom.get_information('age_group'))
+        if group is not None:
+            group.append(atom)
+    return {age_group: selected[herd.model.get_value(age_group)] for age_group in age_groups}